@@ -1,61 +1,390 @@
 # Functions dictating behavior of agents
 
-from openai import OpenAI
+from openai import AsyncOpenAI, BadRequestError, DefaultAsyncHttpxClient
+import ast
+import asyncio
+import hashlib
+import importlib.util
 import json
-import requests
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import weakref
+
+import httpx
+import numpy as np
+
+from llm_cache import cached_chat_completion, cached_chat_completion_stream
+from utils import run_code_in_sub, scratch_dir
+
+logger = logging.getLogger(__name__)
+
+PLAN_CACHE_PATH = ".plan_cache.db"
+PLAN_CACHE_THRESHOLD = 0.9
+PLAN_CACHE_TTL = 30 * 86400
+EMBEDDING_MODEL = "text-embedding-3-small"
+NASA_APIS_TOP_K = 5
+NASA_APIS_URL = "https://raw.githubusercontent.com/nasa/api-docs/gh-pages/assets/json/apis.json"
+NASA_APIS_CACHE_PATH = os.path.expanduser("~/.cache/dashgen/nasa_apis.json")
+NASA_APIS_TTL = 86400
+
+# Performance guidance for generated data and dashboard code, shared by all generating agents
+DATA_GUIDELINES = """\
+- Create one requests.Session (cached with @st.cache_resource when used in Streamlit) and reuse it for every request so connections stay alive. Always pass a timeout (e.g. timeout=(3, 10)) and call raise_for_status().
+- When several endpoints are needed, fetch them concurrently (e.g. concurrent.futures.ThreadPoolExecutor or asyncio.gather) rather than one after another.
+- Push column selection and filtering into the API query (e.g. select only needed columns, WHERE clauses, TOP N, default_flag=1 for the Exoplanet Archive TAP service) instead of downloading whole tables and filtering locally.
+- Request CSV from tabular services that offer it and parse it in one pass with pd.read_csv(dtype={...}), using float32 for measurements and category for repeated labels, instead of per-column pd.to_numeric loops.
+- Parse timestamp columns with pd.to_datetime(..., format=<the API's fixed format>, utc=True, errors="coerce") instead of letting pandas infer the format."""
+DASHBOARD_GUIDELINES = """\
+- Wrap data fetching in a function decorated with @st.cache_data(ttl=...) whose arguments are the query window (e.g. start and end date strings), so reruns do not refetch. Never use the deprecated @st.cache.
+- When several data sources are shown together, combine them once in the cached loader into one DataFrame with a category column naming the source, and derive views from it instead of concatenating on every rerun.
+- Store repeated string columns (types, classes, methods, event or message types) as category dtype once after loading, and filter them with isin and group on them directly.
+- Drop unneeded records before building DataFrames, matching text with regexes compiled once at module level (re.IGNORECASE) rather than lowercased copies of each string, and compute each filter mask once and reuse it for every chart and table that shows the same selection.
+- Put sidebar filtering of the loaded (or combined) frame in a pure @st.cache_data function taking hashable arguments (e.g. tuple(sorted(selection)), start and end dates) so unchanged selections reuse the previous result. Sort frames by date once in the cached loader and slice date ranges with searchsorted and .iloc; use Series.between on unsorted data.
+- Compute summary metrics (value_counts, means, idxmax) and widget bounds such as slider min/max inside @st.cache_data functions too, instead of inline on every rerun.
+- Build Plotly figures in @st.cache_data(persist="disk") functions that return fig.to_json(), and render them with st.plotly_chart(pio.from_json(...)).
+- Use vectorized pandas/numpy operations (boolean masks, np.select, np.where, .str.extract, .str.contains) instead of row-wise df.apply or Python loops over records.
+- Aggregate time series with resample or pd.Grouper(freq=...) on datetime columns, not groupby(df["date"].dt.date).
+- Compute each derived column in one vectorized expression that lets NaN propagate, rather than patching values with .loc afterwards.
+- Plot scatters of more than about 2000 points with WebGL (go.Scattergl or render_mode="webgl") and above about 20000 points use a density heatmap; pre-bin large histograms with np.histogram and draw them with go.Bar.
+- Build download data (e.g. CSV bytes) in an @st.cache_data function and pass it straight to st.download_button, without gating it behind another button. To export frames that were not combined at load time, select their shared columns and write them one after another into one buffer (header only on the first) rather than pd.concat of all columns.
+- Show large tables by passing st.dataframe a pyarrow Table built once in an @st.cache_data function (pa.Table.from_pandas(df, preserve_index=False))."""
+
+PIPELINE_SCHEMA = {
+    "name": "dashboard_pipeline",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "plan": {"type": "object"},
+            "data_code": {"type": "string"},
+            "dashboard_code": {"type": "string"},
+        },
+        "required": ["plan", "data_code", "dashboard_code"],
+    },
+}
+
+
+# Event loop -> (httpx client, AsyncOpenAI client). Streamlit sessions each run their own
+# loop on their own thread, and httpx connections belong to the loop that opened them.
+_clients = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+
+def _loop_clients():
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _clients.get(loop)
+        if clients is None:
+            http = DefaultAsyncHttpxClient(
+                http2=importlib.util.find_spec("h2") is not None,
+                limits=httpx.Limits(max_keepalive_connections=16, keepalive_expiry=300),
+            )
+            clients = _clients[loop] = (http, AsyncOpenAI(http_client=http))
+    return clients
+
+
+def get_http_client():
+    """Returns the running loop's keep-alive httpx client used for OpenAI and NASA requests."""
+    return _loop_clients()[0]
+
+
+def get_client():
+    """Returns the running loop's AsyncOpenAI client so agents reuse warm connections."""
+    return _loop_clients()[1]
+
+
+async def close_clients():
+    """Closes the running loop's clients; call before the loop ends."""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        clients = _clients.pop(loop, None)
+    if clients is not None:
+        await clients[0].aclose()
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _is_json(text):
+    try:
+        json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    return True
+
+
+class PlanCache:
+    """
+    SQLite-backed cache of agent outputs.
+
+    Plans are matched by cosine similarity of prompt embeddings, which are kept in memory
+    as a numpy matrix, and only among plans made with the same planner fingerprint (model
+    and system prompt) within the last ttl seconds. Embeddings of NASA API directory entries
+    are stored by text hash. One instance is shared by all Streamlit sessions, so access is
+    serialized with a lock.
+    """
+
+    def __init__(self, path=PLAN_CACHE_PATH, threshold=PLAN_CACHE_THRESHOLD, ttl=PLAN_CACHE_TTL):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS plans (
+            goal_text TEXT, plan_json TEXT, embedding BLOB, created_at REAL, fingerprint TEXT)""")
+        if "fingerprint" not in [col[1] for col in self.conn.execute("PRAGMA table_info(plans)")]:
+            self.conn.execute("ALTER TABLE plans ADD COLUMN fingerprint TEXT")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS api_embeddings (
+            key TEXT PRIMARY KEY, embedding BLOB)""")
+        self.conn.execute("DELETE FROM plans WHERE created_at < ?", (time.time() - ttl,))
+        self.conn.commit()
+
+        rows = self.conn.execute("SELECT plan_json, embedding, fingerprint, created_at FROM plans").fetchall()
+        self.plans = [json.loads(row[0]) for row in rows]
+        self.embeddings = np.array([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        self.norms = np.linalg.norm(self.embeddings, axis=1) if rows else np.empty(0)
+        self.fingerprints = [row[2] for row in rows]
+        self.created = np.array([row[3] for row in rows], dtype=np.float64)
+
+    def get(self, embedding, fingerprint):
+        """Returns the most similar unexpired plan with this fingerprint, or None below threshold."""
+        with self.lock:
+            if not self.plans:
+                return None
+            q = np.asarray(embedding, dtype=np.float32)
+            sims = np.dot(self.embeddings, q) / (self.norms * np.linalg.norm(q))
+            valid = (np.array(self.fingerprints) == fingerprint) & (self.created >= time.time() - self.ttl)
+            if not valid.any():
+                return None
+            sims = np.where(valid, sims, -np.inf)
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+            logger.info("planner: cache hit sim=%.2f", sims[best])
+            return self.plans[best]
+
+    def put(self, goal_text, embedding, plan, fingerprint):
+        emb = np.asarray(embedding, dtype=np.float32)
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT INTO plans VALUES (?, ?, ?, ?, ?)",
+                              (goal_text, json.dumps(plan), emb.tobytes(), now, fingerprint))
+            self.conn.commit()
+            self.plans.append(plan)
+            self.embeddings = np.vstack([self.embeddings.reshape(-1, emb.size), emb])
+            self.norms = np.append(self.norms, np.linalg.norm(emb))
+            self.fingerprints.append(fingerprint)
+            self.created = np.append(self.created, now)
+
+    def get_api_embeddings(self, texts):
+        """Returns {text: embedding} for the texts that have a stored embedding."""
+        embeddings = {}
+        with self.lock:
+            for text in texts:
+                row = self.conn.execute("SELECT embedding FROM api_embeddings WHERE key = ?",
+                                        (_sha256(text),)).fetchone()
+                if row is not None:
+                    embeddings[text] = np.frombuffer(row[0], dtype=np.float32)
+        return embeddings
+
+    def put_api_embeddings(self, texts, embeddings):
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO api_embeddings VALUES (?, ?)",
+                                  [(_sha256(text), np.asarray(emb, dtype=np.float32).tobytes())
+                                   for text, emb in zip(texts, embeddings)])
+            self.conn.commit()
+
+
+_plan_cache = None
+_plan_cache_lock = threading.Lock()
+
+
+def get_plan_cache():
+    global _plan_cache
+    with _plan_cache_lock:
+        if _plan_cache is None:
+            _plan_cache = PlanCache()
+        return _plan_cache
+
+
+async def fetch_nasa_directory():
+    """
+    Fetches the official NASA APIs directory through an on-disk cache.
+
+    Cached copies younger than NASA_APIS_TTL are returned without a request; older ones
+    are revalidated with a conditional GET.
+
+    Returns:
+        nasa_apis: decoded JSON of the NASA APIs directory
+    """
+    cached = None
+    if os.path.exists(NASA_APIS_CACHE_PATH):
+        try:
+            with open(NASA_APIS_CACHE_PATH) as f:
+                cached = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            cached = None
+
+    if cached and time.time() - cached.get("fetched", 0) < NASA_APIS_TTL:
+        return cached["body"]
+
+    headers = {}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    # A stale copy is better than no directory when NASA cannot be reached
+    try:
+        response = await get_http_client().get(NASA_APIS_URL, headers=headers, timeout=10)
+        if response.status_code == 304 and cached:
+            cached["fetched"] = time.time()
+            _save_nasa_directory(cached)
+            return cached["body"]
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        if not cached:
+            raise
+        logger.warning("NASA APIs directory refresh failed, using stale copy: %s", e)
+        return cached["body"]
+
+    nasa_apis = response.json()
+    _save_nasa_directory({
+        "etag": response.headers.get("etag"),
+        "last_modified": response.headers.get("last-modified"),
+        "body": nasa_apis,
+        "fetched": time.time(),
+    })
+    return nasa_apis
+
+
+def _save_nasa_directory(data):
+    # The cache is best effort, a failed write must not fail the fetch
+    try:
+        _write_json_atomic(NASA_APIS_CACHE_PATH, data)
+    except OSError as e:
+        logger.warning("Could not write NASA APIs directory cache: %s", e)
+
 
-from utils import run_code_in_sub
+def _write_json_atomic(path, data):
+    # Unique temp file per call, since concurrent Streamlit sessions share one process
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), suffix=".tmp", delete=False) as f:
+        json.dump(data, f)
+    try:
+        os.replace(f.name, path)
+    except OSError:
+        os.unlink(f.name)
+        raise
+
+
+async def select_nasa_apis(plan, nasa_apis, k=NASA_APIS_TOP_K):
+    """
+    Picks the NASA APIs most relevant to the plan by embedding similarity.
+
+    Args:
+        plan: JSON from planning_agent, or the user prompt when there is no plan yet
+        nasa_apis: NASA APIs directory JSON
+        k: number of APIs to keep
+
+    Returns:
+        apis: the k most relevant directory entries, or nasa_apis unchanged if it is not a longer list
+    """
+    if not isinstance(nasa_apis, list) or len(nasa_apis) <= k:
+        return nasa_apis
+
+    client = get_client()
+    cache = get_plan_cache()
+    texts = [json.dumps(api, sort_keys=True) for api in nasa_apis]
+    embeddings = cache.get_api_embeddings(texts)
+    missing = [text for text in texts if text not in embeddings]
+
+    # Embed the plan along with any directory entries not seen before
+    response = await client.embeddings.create(model=EMBEDDING_MODEL, input=missing + [json.dumps(plan)])
+    vectors = [np.asarray(d.embedding, dtype=np.float32) for d in response.data]
+    if missing:
+        cache.put_api_embeddings(missing, vectors[:-1])
+        embeddings.update(zip(missing, vectors[:-1]))
+
+    E = np.array([embeddings[text] for text in texts])
+    q = vectors[-1]
+    sims = np.dot(E, q) / (np.linalg.norm(E, axis=1) * np.linalg.norm(q))
+    return [nasa_apis[i] for i in np.argsort(sims)[::-1][:k]]
 
-def planning_agent(user_prompt):
+
+async def planning_agent(user_prompt, use_cache=True):
     """
     Plans dashboard project.
     
     Args:
         user_prompt: description of dashboard request
+        use_cache: reuse cached LLM responses and plans of similar earlier prompts
 
     Returns:
         plan: JSON prompt agent output describing plan for dashboard  
     """
-    client = OpenAI()
+    client = get_client()
+    model = "gpt-4.1-nano"
     system_prompt = """You are the head AI agent working to make dashboards using NASA API data. 
     Your goal is to make interesting interactive dashboards that include tools to help users understand 
     the data. Convert user prompt into JSON plan with specific tasks for other AI developers to follow. 
     Include list of specific data needed for Data Sourcing Agent to find. Do not include ``` header."""
 
-    response = client.chat.completions.create(
-                model = "gpt-4.1-nano",
+    # Reuse plan from a semantically similar earlier prompt to the same planner if one exists
+    cache = get_plan_cache()
+    fingerprint = _sha256(model + system_prompt)
+    embedding = (await client.embeddings.create(model=EMBEDDING_MODEL, input=user_prompt)).data[0].embedding
+    cached_plan = cache.get(embedding, fingerprint) if use_cache else None
+    if cached_plan is not None:
+        return cached_plan
+
+    response = await cached_chat_completion(client,
+                model = model,
                 messages = [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
                     ],
-                temperature = 0.3
+                temperature = 0.3,
+                use_cache = use_cache,
+                validate = _is_json
             )
     
     try:
-        return json.loads(response.choices[0].message.content)
+        plan = json.loads(response.choices[0].message.content)
     except json.JSONDecodeError:
         return {"error": "Parsing failed", "response": response.choices[0].message.content}
 
+    cache.put(user_prompt, embedding, plan, fingerprint)
+    return plan
+
 
-def data_agent(plan):
+async def data_agent(plan, nasa_apis=None, use_cache=True):
     """
     Finds data sources based on generated plan. Validates data sourcing.
 
     Args: 
         plan: JSON with specific data requirements
+        nasa_apis: NASA APIs directory JSON, fetched here if not given
+        use_cache: reuse cached LLM responses
 
     Returns:
         data_info: Python code string to pull valid NASA data, based on the official NASA APIs directory.
     """
-    client = OpenAI()
+    client = get_client()
 
     # Fetch NASA API directory JSON from official GitHub source
-    nasa_apis_url = "https://raw.githubusercontent.com/nasa/api-docs/gh-pages/assets/json/apis.json"
-    try:
-        response = requests.get(nasa_apis_url, timeout=10)
-        nasa_apis = response.json()
-    except Exception as e:
-        return f"# Error fetching NASA APIs list: {e}"
+    if nasa_apis is None:
+        try:
+            nasa_apis = await fetch_nasa_directory()
+        except Exception as e:
+            return f"# Error fetching NASA APIs list: {e}"
+
+    # Only include the APIs relevant to this plan in the prompt
+    nasa_apis = await select_nasa_apis(plan, nasa_apis)
 
     system_prompt = f"""You are a data sourcing agent. Based on the prompt plan, 
     find the proper NASA API data to get the required data. Use only the following list of NASA APIs and no others:
@@ -66,17 +395,20 @@ def data_agent(plan):
     Then, generate valid Python code to pull that data. Do not use placeholders.
     Only return the valid Python code to source the data. This code will be used. Complete all the requirements
     given by the prompt agent. Be sure that there is actual data. Use historical data if no live data is available. Find as much data as possible.
-    Do not include any markdown or ``` headers. Only python code."""
+    Do not include any markdown or ``` headers. Only python code.
+    Performance guidelines:
+    {DATA_GUIDELINES}"""
 
     user_content = json.dumps(plan)
 
-    response = client.chat.completions.create(
+    response = await cached_chat_completion(client,
                 model = "gpt-4.1-mini",
                 messages = [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_content}
                     ],
-                temperature = 0.3
+                temperature = 0.3,
+                use_cache = use_cache
             )
     data_info = response.choices[0].message.content
     return data_info
@@ -84,36 +416,40 @@ def data_agent(plan):
     
 
 
-def coder_agent(plan, data_info):
+async def coder_agent(plan, data_info, use_cache=True):
     """
     Generates full dashboard code using the project plan and data source information.
 
     Args:
         plan: JSON from planning_agent
         data_info: Python code as string from data_agent #(verified by validation function)
+        use_cache: reuse cached LLM responses
 
     Returns:
         dashboard_code: string of full Python code for interactive dashboard
     """
-    client = OpenAI()
+    client = get_client()
 
-    system_prompt = """You are a skilled software engineer proficient in Python. You receive a project plan and 
+    system_prompt = f"""You are a skilled software engineer proficient in Python. You receive a project plan and 
     Python code that pulls data from NASA APIs. Your job is to use the data to produce a complete Streamlit dashboard.
     Dashboard should be interactive, visualize data using plots as needed, include titles and explanations, 
     be readable and modular, include data fetching and loading code as given by data agent, handle errors in data. 
     Return only working executable complete Python code as your final output. Do not use markdown formatting. 
     No '```python'
-    Do not make up example or synthetic data."""
+    Do not make up example or synthetic data.
+    Performance guidelines:
+    {DASHBOARD_GUIDELINES}"""
     
     user_prompt = f'''Plan:\n{json.dumps(plan, indent=1)}\nData Info:\n{data_info}'''
 
-    response = client.chat.completions.create(
+    response = await cached_chat_completion(client,
                 model = "gpt-4.1-nano",
                 messages = [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
                     ],
-                temperature = 0.3
+                temperature = 0.3,
+                use_cache = use_cache
             )
     try:
         return response.choices[0].message.content
@@ -123,14 +459,100 @@ def coder_agent(plan, data_info):
 
 
 
-def debug_agent(initial_code, iterations=2, filename="dashboard_test.py"):
+async def validate_data_code(code):
+    """
+    Checks that data agent code parses as Python.
+
+    Args:
+        code: Python code string from data_agent
+
+    Returns:
+        error: syntax error message, or None if the code parses
+    """
+    try:
+        await asyncio.to_thread(ast.parse, code)
+    except SyntaxError as e:
+        return f"SyntaxError: {e.msg} (line {e.lineno})"
+    return None
+
+
+def _run_score(run_result):
+    """
+    Ranks a run by its failure signals, lower is better.
+
+    Streamlit exits 0 when terminated even if the script raised, so a clean run also needs
+    no traceback in stderr and no exception element in the html.
+
+    Args:
+        run_result: dict returned by run_code_in_sub
+
+    Returns:
+        score: tuple (timed out, nonzero exit, stderr errors, html exceptions, stderr length);
+            the first four are all zero for a clean run
+    """
+    stderr = run_result["stderr"] or ""
+    html = run_result["html"] or ""
+    return (
+        int(run_result["timed_out"]),
+        int(run_result["returncode"] != 0),
+        stderr.count("Traceback") + stderr.count("Uncaught app exception"),
+        html.count("stException"),
+        len(stderr),
+    )
+
+
+async def _race_candidates(candidates, base_port, render_html):
+    """
+    Runs candidate codes side by side and picks the best one.
+
+    Args:
+        candidates: list of (code, path) tuples, with code already saved to path
+        base_port: Streamlit port for the first candidate, others use the following ports
+        render_html: capture rendered dashboard html with Playwright
+
+    Returns:
+        (code, run_result): first candidate that ran cleanly, else the one with the best _run_score
+    """
+    async def run(j, code, path):
+        run_result = await run_code_in_sub(path, port=base_port + j, render_html=render_html)
+        return code, run_result
+
+    pending = {asyncio.create_task(run(j, code, path)) for j, (code, path) in enumerate(candidates)}
+    finished = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                code, run_result = task.result()
+                if _run_score(run_result)[:4] == (0, 0, 0, 0):
+                    return code, run_result
+                finished.append((code, run_result))
+    finally:
+        # Stop the losing runs, also when a candidate raised, and wait for their cleanup
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    return min(finished, key=lambda c: _run_score(c[1]))
+
+
+async def debug_agent(initial_code, iterations=2, filename="dashboard_test.py", temperatures=(0.1, 0.3, 0.6),
+                      render_html=True, use_cache=True):
     """
     Iteratively debug Python dashboard code by running and fixing it multiple times.
 
+    Before the last iteration, one fix is requested per temperature and the fixes are run
+    concurrently in the next one. The first that runs cleanly (exit 0, no timeout, no
+    traceback in stderr, no exception in the html) is carried forward, otherwise the one
+    with the fewest failure signals.
+
     Args:
         initial_code (str): Initial Python code to debug.
         iterations (int): Number of debug-run cycles to perform.
-        filename (str): Temporary filename to save and run code.
+        filename (str): Temporary filename to save and run code, placed in a per-call scratch directory.
+        temperatures (tuple): Sampling temperatures for speculative fix candidates.
+        render_html (bool): Show the model the rendered dashboard html rather than only checking that it booted.
+        use_cache (bool): Reuse cached LLM fixes.
 
     Returns:
         dict: {
@@ -140,7 +562,7 @@ def debug_agent(initial_code, iterations=2, filename="dashboard_test.py"):
             'logs': list of dicts with keys ['stdout', 'stderr', 'returncode', 'timed_out', 'html', 'port']
         }
     """
-    client = OpenAI()
+    client = get_client()
     current_code = initial_code
     logs = []
 
@@ -158,50 +580,213 @@ def debug_agent(initial_code, iterations=2, filename="dashboard_test.py"):
             If html does not include data, update code with new data sources using NASA API as outlined in current code.
         Do not include '```python' or any headers. Only output clean code."""
 
-    for i in range(iterations):
-        # Save current code to file
-        with open(filename, "w") as f:
-            f.write(current_code)
-
-        # Run and capture output
-        run_result = run_code_in_sub(filename)
-        logs.append(run_result)
-
+    async def request_fix(code, run_result, temperature, path):
         # Build prompt with current code and current run output
-        user_prompt = f"Here is the current code:\n{current_code}\n\n" \
+        user_prompt = f"Here is the current code:\n{code}\n\n" \
                       f"STDOUT:\n{run_result['stdout']}\n" \
                       f"STDERR:\n{run_result['stderr']}\n" \
                       f"HTML OUTPUT:\n{run_result['html']}\n"
 
-        try:
-            response = client.chat.completions.create(
+        # Stream the fix straight into the file it will be run from
+        with open(path, "w") as f:
+            fixed_code = await cached_chat_completion_stream(client, f,
                 model="gpt-4.1",
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt},
                 ],
-                temperature=0.1,
+                temperature=temperature,
+                use_cache=use_cache,
             )
-            current_code = response.choices[0].message.content
-        except Exception as e:
-            return {
-                "status": "failure",
-                "cleaned_code": current_code,
-                "error": f"OpenAI API error: {str(e)}",
-                "logs": logs,
-            }
-
-    # if run_result["returncode"] == 0 and not run_result["timed_out"]:
-    return {
-        "status": "success",
-        "cleaned_code": current_code,
-        "error": None,
-        "logs": logs,
-    }
+        return fixed_code
+
+    # Save initial code to a directory of its own, since concurrent sessions use the same file names
+    run_dir = tempfile.mkdtemp(dir=scratch_dir())
+    filename = os.path.join(run_dir, filename)
+    with open(filename, "w") as f:
+        f.write(initial_code)
+    candidates = [(initial_code, filename)]
+    root, ext = os.path.splitext(filename)
+
+    try:
+        for i in range(iterations):
+            # Run candidates, keeping the best one
+            current_code, run_result = await _race_candidates(
+                candidates, base_port=8502 + i * len(temperatures), render_html=render_html)
+            logs.append(run_result)
+
+            # The last fix is returned without being run, so only speculate before that
+            fix_temperatures = temperatures if i < iterations - 1 else temperatures[:1]
+            paths = [filename] if len(fix_temperatures) == 1 else \
+                    [f"{root}_{j}{ext}" for j in range(len(fix_temperatures))]
+            fix_tasks = [asyncio.create_task(request_fix(current_code, run_result, t, p))
+                         for t, p in zip(fix_temperatures, paths)]
+            try:
+                codes = await asyncio.gather(*fix_tasks)
+                candidates = list(zip(codes, paths))
+            except Exception as e:
+                # Stop the other fixes still streaming before giving up
+                for task in fix_tasks:
+                    task.cancel()
+                await asyncio.gather(*fix_tasks, return_exceptions=True)
+                return {
+                    "status": "failure",
+                    "cleaned_code": current_code,
+                    "error": f"OpenAI API error: {str(e)}",
+                    "logs": logs,
+                }
+
+        current_code = candidates[0][0]
+
+        # if run_result["returncode"] == 0 and not run_result["timed_out"]:
+        return {
+            "status": "success",
+            "cleaned_code": current_code,
+            "error": None,
+            "logs": logs,
+        }
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
         
     # return {
     #     "status": "failure",
     #     "cleaned_code": current_code,
     #     "error": "Code still errors after debugging attempts.",
     #     "logs": logs,
-    # }
\ No newline at end of file
+    # }
+
+
+async def pipeline_agent(user_prompt, nasa_apis, use_cache=True):
+    """
+    Plans, sources data and writes the dashboard in a single structured-output request.
+
+    Args:
+        user_prompt: description of dashboard request
+        nasa_apis: NASA APIs directory JSON
+        use_cache: reuse cached LLM responses
+
+    Returns:
+        dict: {
+            'plan': JSON plan for dashboard,
+            'data_code': Python code string to pull the data,
+            'dashboard_code': string of full Python code for interactive dashboard
+        }
+    """
+    client = get_client()
+    nasa_apis = await select_nasa_apis(user_prompt, nasa_apis)
+
+    system_prompt = f"""You are a full AI pipeline making interactive Streamlit dashboards using NASA API data.
+    In one response, do the work of a planner, a data sourcing agent and a dashboard developer:
+    plan: JSON plan with specific tasks, including the list of specific data needed.
+    data_code: valid Python code that pulls that data. Use only the following list of NASA APIs and no others:
+
+    {json.dumps(nasa_apis, indent=2)}
+
+    If other APIs are needed use only free sources without signup needed. You do not have any API keys other than NASA.
+    Do not use placeholders. Be sure that there is actual data. Use historical data if no live data is available.
+    dashboard_code: complete executable Streamlit dashboard that includes the data code, is interactive, visualizes data
+    using plots as needed, includes titles and explanations and handles errors in data. Do not make up example or synthetic data.
+    Code fields contain only Python code, without markdown or ``` headers.
+    Data performance guidelines:
+    {DATA_GUIDELINES}
+    Dashboard performance guidelines:
+    {DASHBOARD_GUIDELINES}"""
+
+    response = await cached_chat_completion(client,
+                model = "gpt-4.1",
+                messages = [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                    ],
+                temperature = 0.3,
+                response_format = {"type": "json_schema", "json_schema": PIPELINE_SCHEMA},
+                use_cache = use_cache
+            )
+    message = response.choices[0].message
+    if message.content is None:
+        raise ValueError(f"No pipeline output, refusal: {message.refusal}")
+    return json.loads(message.content)
+
+
+async def _generate_chain(user_prompt, report, use_cache):
+    # Fetch the NASA APIs directory while the planning agent is running
+    plan_task = asyncio.create_task(planning_agent(user_prompt, use_cache))
+    nasa_task = asyncio.create_task(fetch_nasa_directory())
+    plan, nasa_apis = await asyncio.gather(plan_task, nasa_task, return_exceptions=True)
+    if isinstance(plan, Exception):
+        raise plan
+    report("Plan", plan)
+
+    if isinstance(nasa_apis, Exception):
+        data_info = f"# Error fetching NASA APIs list: {nasa_apis}"
+    else:
+        data_info = await data_agent(plan, nasa_apis, use_cache)
+    report("Data Info", data_info)
+
+    # Validate the data code while the coder agent is running
+    raw_code, data_error = await asyncio.gather(
+        coder_agent(plan, data_info, use_cache), validate_data_code(data_info))
+    report("Dashboard Code", raw_code)
+    return plan, data_info, raw_code, data_error
+
+
+async def _generate_fused(user_prompt, report, use_cache):
+    try:
+        nasa_apis = await fetch_nasa_directory()
+    except Exception as e:
+        logger.info("pipeline: NASA APIs list unavailable, falling back to agent chain: %s", e)
+        return None
+
+    try:
+        result = await pipeline_agent(user_prompt, nasa_apis, use_cache)
+        plan, data_info, raw_code = result["plan"], result["data_code"], result["dashboard_code"]
+    except (BadRequestError, ValueError, KeyError, TypeError) as e:
+        logger.info("pipeline: single request failed, falling back to agent chain: %s", e)
+        return None
+
+    report("Plan", plan)
+    report("Data Info", data_info)
+    report("Dashboard Code", raw_code)
+    return plan, data_info, raw_code, await validate_data_code(data_info)
+
+
+async def run_pipeline(user_prompt, on_step=None, fused=False, use_cache=True):
+    """
+    Runs all agents from user prompt to debugged dashboard code.
+
+    The NASA APIs directory is fetched while the planning agent is running, and the data
+    code is validated while the coder agent is running. With fused, planning, data sourcing
+    and coding are done in one request instead, falling back to the agent chain if it fails.
+
+    Args:
+        user_prompt: description of dashboard request
+        on_step: optional callback(title, output) called as each agent finishes
+        fused: generate plan, data code and dashboard code with a single pipeline_agent request
+        use_cache: reuse cached LLM responses; pass False to force fresh generations
+
+    Returns:
+        dict: {
+            'plan': plan from planning_agent,
+            'data_info': data code from data_agent,
+            'raw_code': dashboard code from coder_agent,
+            'data_error': syntax error in data_info, or None,
+            'final': result dict from debug_agent
+        }
+    """
+    def report(title, output):
+        if on_step is not None:
+            on_step(title, output)
+
+    try:
+        generated = await _generate_fused(user_prompt, report, use_cache) if fused else None
+        if generated is None:
+            generated = await _generate_chain(user_prompt, report, use_cache)
+        plan, data_info, raw_code, data_error = generated
+
+        final = await debug_agent(raw_code, use_cache=use_cache)
+        report("Final Debugged Code", final["cleaned_code"])
+    finally:
+        await close_clients()
+
+    return {"plan": plan, "data_info": data_info, "raw_code": raw_code,
+            "data_error": data_error, "final": final}
@@ -0,0 +1,152 @@
+# Exact-match cache for deterministic OpenAI chat completion requests
+
+import hashlib
+import json
+import logging
+
+from diskcache import Cache
+from openai.types.chat import ChatCompletion
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "./.llm_cache"
+CACHE_TTL = 7 * 86400
+
+cache = Cache(CACHE_DIR)
+stats = {"hits": 0, "misses": 0}
+
+
+def cache_key(model, messages, temperature, tools=None, **extra):
+    """
+    Builds a cache key from everything that determines a chat completion.
+
+    Args:
+        model: model name
+        messages: list of chat messages
+        temperature: sampling temperature
+        tools: optional tool definitions
+        extra: any other request parameters that affect the output
+
+    Returns:
+        key: SHA-256 hex digest of the request payload
+    """
+    payload = {"model": model, "messages": messages, "temperature": temperature, "tools": tools, **extra}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+async def cached_chat_completion(client, model, messages, temperature, tools=None, use_cache=True, validate=None,
+                                 **kwargs):
+    """
+    Drop-in replacement for client.chat.completions.create that serves repeated requests from disk.
+
+    Args:
+        client: AsyncOpenAI client used on cache miss
+        model, messages, temperature, tools: request parameters (part of cache key)
+        use_cache: serve a cached response if there is one; when False the API is always
+            called and its response replaces the cached one
+        validate: optional check on the message content; responses failing it are not cached
+        kwargs: any other parameters passed through to the API
+
+    Returns:
+        response: ChatCompletion, either cached or fresh
+    """
+    key = cache_key(model, messages, temperature, tools, **kwargs)
+    cached = _lookup(key) if use_cache else None
+    if cached is not None:
+        return cached
+
+    stats["misses"] += 1
+    if tools is not None:
+        kwargs["tools"] = tools
+    response = await client.chat.completions.create(
+        model=model, messages=messages, temperature=temperature, **kwargs
+    )
+    _store(key, response, validate)
+    return response
+
+
+async def cached_chat_completion_stream(client, out, model, messages, temperature, tools=None, use_cache=True,
+                                        validate=None, **kwargs):
+    """
+    Streaming variant of cached_chat_completion that writes message content to a file as it arrives.
+
+    Shares cache entries with cached_chat_completion for the same request.
+
+    Args:
+        client: AsyncOpenAI client used on cache miss
+        out: writable text file receiving the message content
+        model, messages, temperature, tools: request parameters (part of cache key)
+        use_cache: serve a cached response if there is one, as in cached_chat_completion
+        validate: optional check on the message content, as in cached_chat_completion
+        kwargs: any other parameters passed through to the API
+
+    Returns:
+        content: full message content
+    """
+    key = cache_key(model, messages, temperature, tools, **kwargs)
+    cached = _lookup(key) if use_cache else None
+    if cached is not None:
+        content = cached.choices[0].message.content
+        out.write(content)
+        return content
+
+    stats["misses"] += 1
+    if tools is not None:
+        kwargs["tools"] = tools
+    stream = await client.chat.completions.create(
+        model=model, messages=messages, temperature=temperature, stream=True,
+        stream_options={"include_usage": True}, **kwargs
+    )
+    parts = []
+    last_chunk = None
+    finish_reason = None
+    usage = None
+    async for chunk in stream:
+        last_chunk = chunk
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        if choice.finish_reason is not None:
+            finish_reason = choice.finish_reason
+        delta = choice.delta.content or ""
+        out.write(delta)
+        parts.append(delta)
+    content = "".join(parts)
+
+    if last_chunk is not None:
+        response = ChatCompletion(
+            id=last_chunk.id,
+            created=last_chunk.created,
+            model=last_chunk.model,
+            object="chat.completion",
+            choices=[{"index": 0, "finish_reason": finish_reason,
+                      "message": {"role": "assistant", "content": content}}],
+            usage=usage,
+        )
+        _store(key, response, validate)
+    return content
+
+
+def _store(key, response, validate=None):
+    # Only complete answers are cached: not truncated, filtered or refused ones
+    choice = response.choices[0] if response.choices else None
+    content = choice.message.content if choice else None
+    finish_reason = choice.finish_reason if choice else None
+    if finish_reason != "stop" or content is None or (validate is not None and not validate(content)):
+        logger.info("llm_cache: not caching %s, finish_reason=%s", key[:12], finish_reason)
+        return
+    cache.set(key, response.model_dump(), expire=CACHE_TTL)
+
+
+def _lookup(key):
+    cached = cache.get(key)
+    if cached is None:
+        return None
+    stats["hits"] += 1
+    response = ChatCompletion.model_validate(cached)
+    tokens = response.usage.total_tokens if response.usage else 0
+    logger.info("llm_cache: hit %s, saved %d tokens (hits=%d misses=%d)",
+                key[:12], tokens, stats["hits"], stats["misses"])
+    return response
@@ -1,19 +1,26 @@
 # Turns user input into interactive dashboard populated with NASA data using OpenAI agents
 
 import streamlit as st
+import asyncio
+import logging
 import openai
 import os
 import subprocess
-import time
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from agents import planning_agent, data_agent, coder_agent, debug_agent
+from agents import run_pipeline
+from utils import wait_until_healthy
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 NASA_API_KEY = os.getenv("NASA_API_KEY")
 
+# Show the agents' cache hit logs, without the per-request INFO logs of httpx and openai
+logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+for name in ("agents", "llm_cache"):
+    logging.getLogger(name).setLevel(logging.INFO)
+
 
 def main():
     # get user prompt
@@ -25,33 +32,27 @@ def main():
                           "'Make a dashboard to monitor weather on Mars.'\n" )
     
     show_code = st.checkbox("Show code outputs", value=True)
+    fused = st.checkbox("Generate plan, data and dashboard code in a single request (faster)", value=False)
+    use_cache = st.checkbox("Reuse cached results for repeated requests", value=True,
+                            help="Uncheck to force fresh generations, e.g. to retry a broken dashboard.")
 
-    # planning agent
+    # run agents: planning, data sourcing, coding, debugging
     if st.button("Generate Dashboard"):
-        with st.spinner("Planning dashboard..."):
-           plan = planning_agent(prompt)
-           if show_code:
-            st.subheader("Plan")
-            st.json(plan)
-
-        # data agent
-        with st.spinner("Sourcing data..."):
-            data_info = data_agent(plan)
-            if show_code:
-                st.subheader("Data Info")
-                st.code(data_info, language='python')
-
-        with st.spinner("Generating dashboard code..."):
-            raw_code = coder_agent(plan, data_info)
-            if show_code:
-                st.subheader("Dashboard Code")
-                st.code(raw_code, language="python")
-
-        with st.spinner("Debugging dashboard code..."):
-            final_code = debug_agent(raw_code)
-            if show_code:
-                st.subheader("Final Debugged Code")
-                st.code(final_code["cleaned_code"], language="python")
+        def show_step(title, output):
+            if not show_code:
+                return
+            st.subheader(title)
+            if isinstance(output, str):
+                st.code(output, language="python")
+            else:
+                st.json(output)
+
+        with st.spinner("Planning, sourcing data, generating and debugging dashboard..."):
+            results = asyncio.run(run_pipeline(prompt, on_step=show_step, fused=fused, use_cache=use_cache))
+        final_code = results["final"]
+
+        if results["data_error"]:
+            st.warning(f"Data agent code did not parse: {results['data_error']}")
 
         st.success("Dashboard code generated and debugged.")
 
@@ -64,7 +65,8 @@ def main():
 
         # Launch in new subprocess
         subprocess.Popen(["streamlit", "run", "dashboard_final.py", "--server.port", "8502"])
-        time.sleep(3)
+        if not asyncio.run(wait_until_healthy(8502, timeout=10)):
+            st.warning("Dashboard is not responding yet, it may still be starting.")
 
         st.markdown("### Dashboard Launched:")
         st.markdown("[Open dashboard](http://localhost:8502)", unsafe_allow_html=True)
@@ -1,15 +1,95 @@
-import subprocess
-from playwright.sync_api import sync_playwright
-import time
+import asyncio
+import atexit
+import os
+import shutil
+import tempfile
+import httpx
 
-def run_code_in_sub(filename, timeout=10, html_capture_timeout=10):
+_scratch_dir = None
+
+
+def scratch_dir():
+    """
+    Returns a per-process temporary directory for generated code, in memory (/dev/shm) on Linux.
+
+    The directory is removed at interpreter exit.
+    """
+    global _scratch_dir
+    if _scratch_dir is None:
+        _scratch_dir = tempfile.mkdtemp(prefix="dashgen_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+        atexit.register(shutil.rmtree, _scratch_dir, ignore_errors=True)
+    return _scratch_dir
+
+
+# Errors in stderr after which the dashboard cannot come up, so waiting longer is pointless
+FATAL_PATTERNS = (b"ModuleNotFoundError", b"SyntaxError")
+
+
+async def wait_until_healthy(port, timeout):
+    """
+    Polls a Streamlit server's health endpoint.
+
+    Args:
+        port: port of the Streamlit server
+        timeout: seconds to keep polling
+
+    Returns:
+        healthy: True once the server answers, False if it did not within timeout
+    """
+    url = f"http://localhost:{port}/_stcore/health"
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    async with httpx.AsyncClient() as http:
+        while loop.time() < deadline:
+            try:
+                if (await http.get(url, timeout=0.5)).status_code == 200:
+                    return True
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.25)
+    return False
+
+
+async def _fetch_html(port):
+    try:
+        async with httpx.AsyncClient() as http:
+            return (await http.get(f"http://localhost:{port}/", timeout=2)).text
+    except httpx.HTTPError as e:
+        return f"HTML capture failed: {str(e)}"
+
+
+async def _render_html(port):
+    try:
+        from playwright.async_api import async_playwright
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=True)
+            page = await browser.new_page()
+            await page.goto(f"http://localhost:{port}")
+            await page.wait_for_timeout(3000)  # allow rendering
+            html = await page.content()
+            await browser.close()
+        return html
+    except Exception as e:
+        return f"HTML capture failed: {str(e)}"
+
+
+async def run_code_in_sub(filename, port=8502, timeout=10, html_capture_timeout=10, render_html=False):
     """
     Runs a Streamlit dashboard from Python file as subprocess and captures the HTML output.
 
+    Output is read as it arrives; if stderr shows a fatal error the process is killed
+    without waiting for the dashboard to render.
+
+    By default the html is Streamlit's static page, which only shows the server booted.
+    The script itself only runs once a browser session connects, so pass render_html to
+    load the page in headless Chromium (Playwright) and capture the rendered dashboard.
+
     Args:
         filename: path to the Python script to run
+        port: port for the Streamlit server
         timeout: seconds to wait before killing the process
-        html_capture_timeout: seconds to wait before capturing dashboard html
+        html_capture_timeout: seconds to wait for the server to become healthy before capturing html
+        render_html: capture the rendered dashboard with Playwright instead of the static page
     
     Returns:
         dict: {
@@ -20,37 +100,76 @@ def run_code_in_sub(filename, timeout=10, html_capture_timeout=10):
             "html": str
         }
     """
-    process = subprocess.Popen(
-        ["streamlit", "run", filename, "--server.headless true", "--server.port", "8502"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
+    process = await asyncio.create_subprocess_exec(
+        "streamlit", "run", filename, "--server.headless", "true", "--server.port", str(port),
+        "--browser.gatherUsageStats", "false",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
     )
-    time.sleep(html_capture_timeout)
+
+    stdout_lines, stderr_lines = [], []
+    fatal = asyncio.Event()
+
+    async def pump(stream, lines, watch):
+        async for line in stream:
+            lines.append(line.decode(errors="replace"))
+            if watch and any(pattern in line for pattern in FATAL_PATTERNS):
+                fatal.set()
+
+    readers = [asyncio.create_task(pump(process.stdout, stdout_lines, False)),
+               asyncio.create_task(pump(process.stderr, stderr_lines, True))]
+    failed = asyncio.create_task(fatal.wait())
 
     html = ""
+    task = None
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
-            page.goto("http://localhost:8502")
-            page.wait_for_timeout(3000)  # allow rendering
-            html = page.content()
-            browser.close()
-    except Exception as e:
-        html = f"HTML capture failed: {str(e)}"
+        # Wait for the server to come up, then capture the page, unless a fatal error shows first
+        capture = _render_html if render_html else _fetch_html
+        for step in (lambda: wait_until_healthy(port, html_capture_timeout), lambda: capture(port)):
+            task = asyncio.create_task(step())
+            await asyncio.wait({task, failed}, return_when=asyncio.FIRST_COMPLETED)
+            if fatal.is_set():
+                task.cancel()
+                break
+            result = task.result()
+        else:
+            html = result
+    except asyncio.CancelledError:
+        # Cancelled by a competing candidate: stop the capture, readers and process, then reap it
+        for pending in (task, *readers):
+            if pending is not None:
+                pending.cancel()
+        if process.returncode is None:
+            process.kill()
+        try:
+            await asyncio.wait_for(asyncio.shield(process.wait()), 2)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        raise
+    finally:
+        failed.cancel()
 
     # Clean up subprocess
-    process.terminate()
+    if process.returncode is None:
+        if fatal.is_set():
+            process.kill()
+        else:
+            process.terminate()
+
     try:
-        stdout, stderr = process.communicate(timeout=timeout)
+        await asyncio.wait_for(process.wait(), timeout)
         returncode = process.returncode
         timed_out = False
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         process.kill()
-        stdout, stderr = "", "Process timed out."
+        await process.wait()
         returncode = None
         timed_out = True
+    await asyncio.gather(*readers)
+
+    stdout, stderr = "".join(stdout_lines), "".join(stderr_lines)
+    if timed_out:
+        stdout, stderr = "", "Process timed out."
 
     return {
         "stdout": stdout,
@@ -59,4 +178,3 @@ def run_code_in_sub(filename, timeout=10, html_capture_timeout=10):
         "timed_out": timed_out,
         "html": html
     }
-